@@ -4,8 +4,27 @@ import time
 import math
 import numpy as np
 from PIL import Image
-from multiprocessing import Pool
-import functools
+from numba import njit, prange, set_num_threads, config
+
+# Radii from this up use the recursive (IIR) Gaussian, whose cost does not
+# grow with the radius; below it the fixed-point FIR kernels are faster
+IIR_MIN_RADIUS = 4
+# Rows transposed together for the horizontal IIR pass, and columns of the
+# flattened rows each thread carries down the vertical IIR pass
+IIR_GROUP = 16
+IIR_BLOCK = 512
+
+# Fixed-point blur: Q16 kernel weights, and 8 fractional bits kept in the
+# uint16 intermediate between the horizontal and vertical passes. Sums stay
+# in uint32 so twice as many fit per SIMD register as with int64: the
+# horizontal pass peaks at 255 << 16, the vertical at (65280 << 16) + V_ROUND
+KERNEL_BITS = 16
+INTERMEDIATE_BITS = 8
+H_SHIFT = KERNEL_BITS - INTERMEDIATE_BITS
+H_ROUND = 1 << (H_SHIFT - 1)
+# Weights sum to 1 << KERNEL_BITS, so the vertical result never exceeds 255
+V_SHIFT = KERNEL_BITS + INTERMEDIATE_BITS
+V_ROUND = 1 << (V_SHIFT - 1)
 
 def generate_gaussian_kernel(radius):
     size = 2 * radius + 1
@@ -19,69 +38,271 @@ def generate_gaussian_kernel(radius):
     kernel /= kernel.sum()
     return kernel
 
-def blur_horizontal_chunk(args):
-    img_array, kernel, radius, start_y, end_y = args
-    height, width, channels = img_array.shape
-    result = np.zeros((end_y - start_y, width, channels), dtype=np.float32)
-    
-    for y in range(start_y, end_y):
-        for x in range(width):
-            for c in range(channels):
-                pixel_sum = 0.0
-                for k in range(-radius, radius + 1):
-                    sx = x + k
-                    sx = max(0, min(sx, width - 1))
-                    weight = kernel[k + radius]
-                    pixel_sum += img_array[y, sx, c] * weight
-                result[y - start_y, x, c] = pixel_sum
-    
-    return (start_y, end_y, result)
+def quantize_kernel(kernel):
+    # Round to Q16 and fold the rounding error into the centre tap so the
+    # weights sum to exactly 1.0 and flat regions keep their value
+    kq = np.round(kernel * (1 << KERNEL_BITS)).astype(np.int32)
+    kq[len(kq) // 2] += (1 << KERNEL_BITS) - kq.sum()
+    return kq.astype(np.uint32)
 
-def apply_gaussian_blur(img_array, radius, num_workers):
-    height, width, channels = img_array.shape
-    kernel = generate_gaussian_kernel(radius)
+# Rows are handled as flat width * channels runs so every inner loop below
+# walks memory with unit stride and can be vectorized across x and channels
+
+@njit(fastmath=True, boundscheck=False)
+def _blur_row_h(src, dst, kernel, idx, channels, padded, acc):
+    radius = kernel.shape[0] // 2
+    n = dst.shape[0]
+    # Gather the row once with clamped borders, then every tap is a shifted slice
+    for i in range(idx.shape[0]):
+        base = idx[i] * channels
+        for c in range(channels):
+            padded[i * channels + c] = src[base + c]
+    center = radius * channels
+    for j in range(n):
+        acc[j] = np.uint32(padded[center + j]) * kernel[radius]
+    # Symmetric kernel: pair up mirrored taps, one multiply each
+    for k in range(1, radius + 1):
+        weight = kernel[radius + k]
+        hi = (radius + k) * channels
+        lo = (radius - k) * channels
+        for j in range(n):
+            acc[j] += np.uint32(padded[hi + j] + padded[lo + j]) * weight
+    for j in range(n):
+        dst[j] = (acc[j] + np.uint32(H_ROUND)) >> np.uint32(H_SHIFT)
+
+@njit(fastmath=True, boundscheck=False)
+def _blur_row_v(src, rows, dst, kernel, acc):
+    radius = kernel.shape[0] // 2
+    n = dst.shape[0]
+    center = src[rows[radius]]
+    for j in range(n):
+        acc[j] = np.uint32(center[j]) * kernel[radius]
+    for k in range(1, radius + 1):
+        weight = kernel[radius + k]
+        below = src[rows[radius + k]]
+        above = src[rows[radius - k]]
+        for j in range(n):
+            acc[j] += np.uint32(below[j] + above[j]) * weight
+    for j in range(n):
+        dst[j] = (acc[j] + np.uint32(V_ROUND)) >> np.uint32(V_SHIFT)
+
+@njit(parallel=True, fastmath=True, boundscheck=False, cache=True)
+def _blur_h_numba(img, out, kernel, idx, channels):
+    height, row_length = img.shape
+    for y in prange(height):
+        padded = np.empty(idx.shape[0] * channels, dtype=img.dtype)
+        acc = np.empty(row_length, dtype=np.uint32)
+        _blur_row_h(img[y], out[y], kernel, idx, channels, padded, acc)
+
+@njit(parallel=True, fastmath=True, boundscheck=False, cache=True)
+def _blur_v_numba(img, out, kernel, idx):
+    height, row_length = img.shape
+    size = kernel.shape[0]
+    for y in prange(height):
+        acc = np.empty(row_length, dtype=np.uint32)
+        _blur_row_v(img, idx[y:y + size], out[y], kernel, acc)
+
+def deriche_coefficients(sigma):
+    # Deriche's 4th order recursive approximation of a Gaussian
+    a0, a1, b0, b1 = 1.680, 3.735, 1.783, 1.723
+    c0, c1, w0, w1 = -0.6803, -0.2598, 0.6318, 1.997
+    cos0, sin0 = math.cos(w0 / sigma), math.sin(w0 / sigma)
+    cos1, sin1 = math.cos(w1 / sigma), math.sin(w1 / sigma)
+    e0, e1 = math.exp(-b0 / sigma), math.exp(-b1 / sigma)
     
-    # Phase 1: Horizontal blur
-    horizontal = np.zeros_like(img_array, dtype=np.float32)
+    n = np.array([
+        a0 + c0,
+        e1 * (c1 * sin1 - (c0 + 2 * a0) * cos1) + e0 * (a1 * sin0 - (2 * c0 + a0) * cos0),
+        2 * e0 * e1 * ((a0 + c0) * cos1 * cos0 - a1 * cos1 * sin0 - c1 * cos0 * sin1)
+            + c0 * e0 * e0 + a0 * e1 * e1,
+        e1 * e0 * e0 * (c1 * sin1 - c0 * cos1) + e0 * e1 * e1 * (a1 * sin0 - a0 * cos0),
+    ])
+    d = np.array([
+        -2 * e1 * cos1 - 2 * e0 * cos0,
+        4 * cos1 * cos0 * e0 * e1 + e1 * e1 + e0 * e0,
+        -2 * cos0 * e0 * e1 * e1 - 2 * cos1 * e1 * e0 * e0,
+        e0 * e0 * e1 * e1,
+    ])
+    # Anti-causal numerators for x[i+1]..x[i+4]
+    m = np.array([n[1] - d[0] * n[0], n[2] - d[1] * n[0], n[3] - d[2] * n[0], -d[3] * n[0]])
     
-    with Pool(processes=num_workers) as pool:
-        tasks = []
-        rows_per_worker = height // num_workers
+    # Normalize to unit DC gain
+    gain = (n.sum() + m.sum()) / (1.0 + d.sum())
+    return n / gain, m / gain, d
+
+@njit(parallel=True, fastmath=True, boundscheck=False, cache=True)
+def _blur_iir_h_numba(img, out, n, m, d, channels, group):
+    height, row_length = img.shape
+    width = row_length // channels
+    causal_gain = n.sum() / (1.0 + d.sum())
+    anti_gain = m.sum() / (1.0 + d.sum())
+    # Coefficients in locals, so they are not reloaded on every sample
+    n0, n1, n2, n3 = n[0], n[1], n[2], n[3]
+    m0, m1, m2, m3 = m[0], m[1], m[2], m[3]
+    d0, d1, d2, d3 = d[0], d[1], d[2], d[3]
+    num_groups = (height + group - 1) // group
+    # Each thread transposes a group of rows into a tile with one line per
+    # pixel column, so the recursion runs along the tile's first axis and
+    # every inner loop is unit-stride across the group's rows and channels
+    for g in prange(num_groups):
+        y0 = g * group
+        rows = min(group, height - y0)
+        lanes = rows * channels
+        # Four clamped border pixels on each side of the row
+        tile = np.empty((width + 8, lanes), dtype=np.float32)
+        causal = np.empty_like(tile)
+        anti = np.empty_like(tile)
+        for x in range(width + 8):
+            sx = min(max(x - 4, 0), width - 1) * channels
+            line = tile[x]
+            for r in range(rows):
+                src = img[y0 + r]
+                for c in range(channels):
+                    line[r * channels + c] = src[sx + c]
         
-        for i in range(num_workers):
-            start_y = i * rows_per_worker
-            end_y = start_y + rows_per_worker if i < num_workers - 1 else height
-            tasks.append((img_array, kernel, radius, start_y, end_y))
+        # History of each pass primed with the steady state of its edge pixel
+        for x in range(4):
+            for l in range(lanes):
+                causal[x, l] = tile[x, l] * causal_gain
+                anti[width + 4 + x, l] = tile[width + 4 + x, l] * anti_gain
         
-        results = pool.map(blur_horizontal_chunk, tasks)
+        # Causal pass, left to right
+        for x in range(4, width + 4):
+            s0, s1, s2, s3 = tile[x], tile[x - 1], tile[x - 2], tile[x - 3]
+            y1, y2, y3, y4 = causal[x - 1], causal[x - 2], causal[x - 3], causal[x - 4]
+            row = causal[x]
+            for l in range(lanes):
+                row[l] = (n0 * s0[l] + n1 * s1[l] + n2 * s2[l] + n3 * s3[l]
+                          - d0 * y1[l] - d1 * y2[l] - d2 * y3[l] - d3 * y4[l])
         
-        for start_y, end_y, chunk_result in results:
-            horizontal[start_y:end_y] = chunk_result
-    
-    # Transpose for vertical pass
-    transposed = np.transpose(horizontal, (1, 0, 2))
-    
-    # Phase 2: Vertical blur (horizontal on transposed)
-    height_t, width_t = transposed.shape[:2]
-    blurred = np.zeros_like(transposed, dtype=np.float32)
-    
-    with Pool(processes=num_workers) as pool:
-        tasks = []
-        rows_per_worker = height_t // num_workers
+        # Anti-causal pass, right to left, summed into the causal result
+        for x in range(width + 3, 3, -1):
+            s1, s2, s3, s4 = tile[x + 1], tile[x + 2], tile[x + 3], tile[x + 4]
+            y1, y2, y3, y4 = anti[x + 1], anti[x + 2], anti[x + 3], anti[x + 4]
+            row = anti[x]
+            total = causal[x]
+            for l in range(lanes):
+                row[l] = (m0 * s1[l] + m1 * s2[l] + m2 * s3[l] + m3 * s4[l]
+                          - d0 * y1[l] - d1 * y2[l] - d2 * y3[l] - d3 * y4[l])
+                total[l] += row[l]
         
-        for i in range(num_workers):
-            start_y = i * rows_per_worker
-            end_y = start_y + rows_per_worker if i < num_workers - 1 else height_t
-            tasks.append((transposed, kernel, radius, start_y, end_y))
+        # Transpose back into the group's output rows
+        for r in range(rows):
+            dst = out[y0 + r]
+            for x in range(width):
+                line = causal[x + 4]
+                for c in range(channels):
+                    dst[x * channels + c] = line[r * channels + c]
+
+@njit(parallel=True, fastmath=True, boundscheck=False, cache=True)
+def _blur_iir_v_numba(img, out, n, m, d, block):
+    height, row_length = img.shape
+    causal_gain = n.sum() / (1.0 + d.sum())
+    anti_gain = m.sum() / (1.0 + d.sum())
+    n0, n1, n2, n3 = n[0], n[1], n[2], n[3]
+    m0, m1, m2, m3 = m[0], m[1], m[2], m[3]
+    d0, d1, d2, d3 = d[0], d[1], d[2], d[3]
+    num_blocks = (row_length + block - 1) // block
+    # Each thread owns a band of columns and runs the recursion down it row
+    # by row, so the inner loops are unit-stride across the band. The last
+    # four output rows of the recursion live in a small ring
+    for b in prange(num_blocks):
+        x0 = b * block
+        x1 = min(x0 + block, row_length)
+        width = x1 - x0
+        causal = np.empty((height, width), dtype=np.float32)
+        ring = np.empty((4, width), dtype=np.float32)
         
-        results = pool.map(blur_horizontal_chunk, tasks)
+        # Causal pass, top to bottom
+        for k in range(4):
+            for j in range(width):
+                ring[k, j] = img[0, x0 + j] * causal_gain
+        for y in range(height):
+            s0 = img[y, x0:x1]
+            s1 = img[max(y - 1, 0), x0:x1]
+            s2 = img[max(y - 2, 0), x0:x1]
+            s3 = img[max(y - 3, 0), x0:x1]
+            y1 = ring[(y + 3) % 4]
+            y2 = ring[(y + 2) % 4]
+            y3 = ring[(y + 1) % 4]
+            y4 = ring[y % 4]
+            row = causal[y]
+            for j in range(width):
+                v = (n0 * s0[j] + n1 * s1[j] + n2 * s2[j] + n3 * s3[j]
+                     - d0 * y1[j] - d1 * y2[j] - d2 * y3[j] - d3 * y4[j])
+                row[j] = v
+                y4[j] = v  # Oldest slot becomes the newest
         
-        for start_y, end_y, chunk_result in results:
-            blurred[start_y:end_y] = chunk_result
+        # Anti-causal pass, bottom to top, rounded and saturated into uint8
+        last = height - 1
+        for k in range(4):
+            for j in range(width):
+                ring[k, j] = img[last, x0 + j] * anti_gain
+        for y in range(last, -1, -1):
+            s1 = img[min(y + 1, last), x0:x1]
+            s2 = img[min(y + 2, last), x0:x1]
+            s3 = img[min(y + 3, last), x0:x1]
+            s4 = img[min(y + 4, last), x0:x1]
+            y1 = ring[(y + 1) % 4]
+            y2 = ring[(y + 2) % 4]
+            y3 = ring[(y + 3) % 4]
+            y4 = ring[y % 4]
+            row = causal[y]
+            dst = out[y, x0:x1]
+            for j in range(width):
+                v = (m0 * s1[j] + m1 * s2[j] + m2 * s3[j] + m3 * s4[j]
+                     - d0 * y1[j] - d1 * y2[j] - d2 * y3[j] - d3 * y4[j])
+                y4[j] = v
+                dst[j] = np.uint8(min(max(row[j] + v + 0.5, 0.0), 255.0))
+
+@njit(parallel=True, fastmath=True, boundscheck=False, cache=True)
+def _saturate_cast_u8(src, dst):
+    for i in prange(src.shape[0]):
+        dst[i] = np.uint8(min(max(src[i], 0.0), 255.0))
+
+def saturate_cast_u8(array):
+    # Clamp to 0..255 and truncate to uint8 in a single pass over the data,
+    # same result as np.clip(array, 0, 255).astype(np.uint8)
+    array = np.ascontiguousarray(array)
+    out = np.empty(array.shape, dtype=np.uint8)
+    _saturate_cast_u8(array.reshape(-1), out.reshape(-1))
+    return out
+
+def clamped_indices(radius, length):
+    # Source index for every tap position, clamped to the border
+    return np.clip(np.arange(-radius, length + radius), 0, length - 1).astype(np.int32)
+
+def apply_gaussian_blur(img_array, radius, num_workers):
+    # Every path works on and returns 8-bit pixels, so other input (e.g. the
+    # float32 arrays earlier callers passed) is saturated to uint8 first
+    if img_array.dtype != np.uint8:
+        img_array = saturate_cast_u8(img_array)
+    height, width, channels = img_array.shape
+    set_num_threads(max(1, min(num_workers, config.NUMBA_NUM_THREADS)))
+    
+    # Both filters work on rows flattened to width * channels
+    rows = np.ascontiguousarray(img_array).reshape(height, width * channels)
+    blurred = np.empty_like(rows)
+    
+    # Large kernels: recursive filter, constant work per pixel
+    if radius >= IIR_MIN_RADIUS:
+        n, m, d = deriche_coefficients(radius / 3.0)
+        horizontal = np.empty(rows.shape, dtype=np.float32)
+        _blur_iir_h_numba(rows, horizontal, n, m, d, channels, IIR_GROUP)
+        _blur_iir_v_numba(horizontal, blurred, n, m, d, IIR_BLOCK)
+        return blurred.reshape(img_array.shape)
+    
+    kernel = quantize_kernel(generate_gaussian_kernel(radius))
+    idx_x = clamped_indices(radius, width)
+    idx_y = clamped_indices(radius, height)
+    
+    # Phase 1: Horizontal blur
+    horizontal = np.empty(rows.shape, dtype=np.uint16)
+    _blur_h_numba(rows, horizontal, kernel, idx_x, channels)
     
-    # Transpose back
-    final = np.transpose(blurred, (1, 0, 2))
-    return final
+    # Phase 2: Vertical blur, reading straight down the columns
+    _blur_v_numba(horizontal, blurred, kernel, idx_y)
+    return blurred.reshape(img_array.shape)
 
 def main():
     if len(sys.argv) != 5:
@@ -96,7 +317,7 @@ def main():
     # Load image
     start_time = time.time()
     img = Image.open(input_path).convert('RGBA')
-    img_array = np.array(img, dtype=np.float32)
+    img_array = np.array(img)
     load_time = time.time() - start_time
     print(f"Image loading took {load_time * 1000:.2f}ms")
     
@@ -108,7 +329,6 @@ def main():
     
     # Save image
     start_time = time.time()
-    blurred_array = np.clip(blurred_array, 0, 255).astype(np.uint8)
     blurred_img = Image.fromarray(blurred_array)
     blurred_img.save(output_path)
     save_time = time.time() - start_time
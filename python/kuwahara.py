@@ -1,24 +1,52 @@
 #!/usr/bin/env python3
 import numpy as np
-from multiprocessing import Pool
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import time
 
+# Tile size in pixels, small enough that the per-tile quadrant statistics
+# (4 quadrants x float64 RGB) and the SAT rows they read stay in L2
+TILE_HEIGHT = 32
+TILE_WIDTH = 128
+
 class IntegralImage:
-    def __init__(self, img_array):
+    def __init__(self, img_array, table=None):
         h, w, c = img_array.shape
-        # Pad with zeros for easier boundary handling
-        self.sum = np.zeros((h + 1, w + 1, c), dtype=np.float64)
-        self.sum_sq = np.zeros((h + 1, w + 1, c), dtype=np.float64)
-        
+        # One contiguous record per pixel: c channel sums followed by c
+        # squared sums, so each region corner is a single lookup. 8-bit
+        # pixels keep both sums exact in int64. Padded with zeros for
+        # easier boundary handling. `table` may be a preallocated
+        # (h + 1, w + 1, 2c) int64 array, e.g. backed by shared memory
+        if table is None:
+            table = np.zeros((h + 1, w + 1, 2 * c), dtype=np.int64)
+        else:
+            table[0] = 0
+            table[:, 0] = 0
+        self._bind(table)
+
         # Build integral images
-        for y in range(1, h + 1):
-            for x in range(1, w + 1):
-                pixel = img_array[y - 1, x - 1]
-                self.sum[y, x] = pixel + self.sum[y-1, x] + self.sum[y, x-1] - self.sum[y-1, x-1]
-                self.sum_sq[y, x] = pixel * pixel + self.sum_sq[y-1, x] + self.sum_sq[y, x-1] - self.sum_sq[y-1, x-1]
+        pixels = img_array.astype(np.int64)
+        self.sum[1:, 1:] = np.cumsum(np.cumsum(pixels, axis=0), axis=1)
+        self.sum_sq[1:, 1:] = np.cumsum(np.cumsum(pixels * pixels, axis=0), axis=1)
+    
+    @classmethod
+    def from_table(cls, table):
+        # Wrap a table that has already been built, without recomputing it
+        integral = cls.__new__(cls)
+        integral._bind(table)
+        return integral
+    
+    def _bind(self, table):
+        c = table.shape[2] // 2
+        self.table = table
+        self.sum = table[:, :, :c]
+        self.sum_sq = table[:, :, c:]
+        self.channels = c
         
-        self.height = h
-        self.width = w
+        self.height = table.shape[0] - 1
+        self.width = table.shape[1] - 1
     
     def get_region_stats(self, x1, y1, x2, y2):
         # Clamp coordinates
@@ -36,78 +64,164 @@ class IntegralImage:
         area = (x2 - x1 + 1) * (y2 - y1 + 1)
         
         if area > 0:
-            # Calculate sum using integral image
-            sum_val = (self.sum[y2, x2] - self.sum[y2, x1-1] - 
-                      self.sum[y1-1, x2] + self.sum[y1-1, x1-1])
-            
-            # Calculate sum of squares
-            sum_sq_val = (self.sum_sq[y2, x2] - self.sum_sq[y2, x1-1] - 
-                         self.sum_sq[y1-1, x2] + self.sum_sq[y1-1, x1-1])
+            # Calculate sum and sum of squares using integral image
+            totals = (self.table[y2, x2] - self.table[y2, x1-1] - 
+                      self.table[y1-1, x2] + self.table[y1-1, x1-1])
+            sum_val = totals[:self.channels]
+            sum_sq_val = totals[self.channels:]
             
             mean = sum_val / area
             variance = np.maximum((sum_sq_val / area) - (mean * mean), 0)
             
             return mean, variance
         else:
-            return np.zeros(4), np.zeros(4)
+            return np.zeros(self.channels), np.zeros(self.channels)
+
+    def region_stats_vec(self, x1, y1, x2, y2):
+        # Clamp coordinates and adjust for 1-indexed integral image
+        x1 = np.maximum(x1, 0) + 1
+        y1 = np.maximum(y1, 0) + 1
+        x2 = np.minimum(x2, self.width - 1) + 1
+        y2 = np.minimum(y2, self.height - 1) + 1
+        
+        area = ((x2 - x1 + 1) * (y2 - y1 + 1))[..., np.newaxis]
+        
+        # Corner lookups broadcast over all requested regions at once, each
+        # corner fetching its sum and squared sum as one record
+        totals = (self.table[y2, x2] - self.table[y2, x1-1] - 
+                  self.table[y1-1, x2] + self.table[y1-1, x1-1])
+        sum_val = totals[..., :self.channels]
+        sum_sq_val = totals[..., self.channels:]
+        
+        mean = sum_val / area
+        variance = np.maximum((sum_sq_val / area) - (mean * mean), 0)
+        
+        return mean, variance
+
+def _pool_context():
+    # Forking a process that has already run Numba's parallel (threaded)
+    # kernels leaves it unable to exit, so never fork workers from the caller
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+# Worker pool kept across calls, so process start-up and each worker's
+# imports are paid once rather than on every filter call
+_executor = None
+_executor_workers = 0
+
+def _worker_pool(num_workers):
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != num_workers:
+        shutdown_worker_pool()
+        _executor = ProcessPoolExecutor(max_workers=num_workers,
+                                        mp_context=_pool_context())
+        _executor_workers = num_workers
+    return _executor
+
+def shutdown_worker_pool():
+    # Stop the persistent workers; the next filter call starts a fresh pool
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+def _shared_array(shm, shape, dtype):
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
 
 def kuwahara_filter_chunk(args):
-    img_array, integral, radius, start_y, end_y = args
-    height, width, channels = img_array.shape
-    result = np.zeros((end_y - start_y, width, channels), dtype=np.float32)
+    radius, start_y, end_y, tile_height, tile_width, table_name, output_name, shape = args
+    height, width, channels = shape
     
-    for y in range(start_y, end_y):
-        for x in range(width):
-            min_variance = float('inf')
-            best_mean = None
-            
-            # Define quadrants
-            quadrants = [
-                (x - radius, y - radius, x, y),          # Top-left
-                (x, y - radius, x + radius, y),          # Top-right
-                (x - radius, y, x, y + radius),          # Bottom-left
-                (x, y, x + radius, y + radius)           # Bottom-right
-            ]
-            
-            for quad in quadrants:
-                mean, variance = integral.get_region_stats(*quad)
-                total_variance = variance[:3].sum()  # Sum RGB variances
-                
-                if total_variance < min_variance:
-                    min_variance = total_variance
-                    best_mean = mean
+    # The integral table and the RGB output live in shared memory created
+    # per call, so the long-lived workers attach to them by name
+    table_shm = SharedMemory(name=table_name)
+    output_shm = SharedMemory(name=output_name)
+    try:
+        table = _shared_array(table_shm, (height + 1, width + 1, 2 * channels), np.int64)
+        output = _shared_array(output_shm, shape, np.float32)
+        _filter_rows(IntegralImage.from_table(table), output[start_y:end_y],
+                     radius, start_y, end_y, tile_height, tile_width)
+        # Views must be released before the mappings can be closed
+        del table, output
+    finally:
+        table_shm.close()
+        output_shm.close()
+
+def _filter_rows(integral, result, radius, start_y, end_y, tile_height, tile_width):
+    width = integral.width
+    
+    # Quadrant columns for each tile column: top-left, top-right, bottom-left, bottom-right
+    tile_columns = []
+    for x0 in range(0, width, tile_width):
+        xs = np.arange(x0, min(x0 + tile_width, width))
+        x1 = np.stack([xs - radius, xs, xs - radius, xs])[:, np.newaxis, :]
+        x2 = np.stack([xs, xs + radius, xs, xs + radius])[:, np.newaxis, :]
+        tile_columns.append((x0, x0 + len(xs), x1, x2))
+    
+    # Walk the strip tile by tile so the SAT rows each tile touches stay cached
+    for y0 in range(start_y, end_y, tile_height):
+        ys = np.arange(y0, min(y0 + tile_height, end_y))
+        y1 = np.stack([ys - radius, ys - radius, ys, ys])[:, :, np.newaxis]
+        y2 = np.stack([ys, ys, ys + radius, ys + radius])[:, :, np.newaxis]
+        rows = slice(y0 - start_y, y0 - start_y + len(ys))
+        
+        for x0, x_end, x1, x2 in tile_columns:
+            mean, variance = integral.region_stats_vec(x1, y1, x2, y2)
+            total_variance = variance.sum(axis=3)  # Sum RGB variances
+            best = total_variance.argmin(axis=0)
             
             # Set pixel to mean of region with minimum variance
-            result[y - start_y, x, :3] = best_mean[:3]
-            # Preserve alpha channel
-            result[y - start_y, x, 3] = img_array[y, x, 3]
-    
-    return (start_y, end_y, result)
+            best_mean = np.take_along_axis(mean, best[np.newaxis, :, :, np.newaxis], axis=0)[0]
+            result[rows, x0:x_end] = best_mean
 
 def apply_kuwahara_filter(img_array, radius, num_workers):
     height, width, channels = img_array.shape
     
-    # Build integral images (SAT)
-    start_time = time.time()
-    integral = IntegralImage(img_array)
-    sat_time = time.time() - start_time
-    print(f"SAT build time: {sat_time * 1000:.0f}ms")
-    
-    # Apply Kuwahara filter
-    output = np.zeros_like(img_array, dtype=np.float32)
+    # Alpha passes through untouched, so only RGB goes into the SAT
+    rgb = img_array[..., :3]
+    alpha = img_array[..., 3:]
     
-    with Pool(processes=num_workers) as pool:
+    table_shm = SharedMemory(create=True, size=(height + 1) * (width + 1) * 2 * rgb.shape[2] * 8)
+    output_shm = SharedMemory(create=True, size=rgb.size * 4)
+    try:
+        # Build integral images (SAT)
+        start_time = time.time()
+        table = _shared_array(table_shm, (height + 1, width + 1, 2 * rgb.shape[2]), np.int64)
+        IntegralImage(rgb, table)
+        sat_time = time.time() - start_time
+        print(f"SAT build time: {sat_time * 1000:.0f}ms")
+        
+        # Apply Kuwahara filter
+        rgb_out = _shared_array(output_shm, rgb.shape, np.float32)
         tasks = []
         rows_per_worker = height // num_workers
         
         for i in range(num_workers):
             start_y = i * rows_per_worker
             end_y = start_y + rows_per_worker if i < num_workers - 1 else height
-            tasks.append((img_array, integral, radius, start_y, end_y))
+            tasks.append((radius, start_y, end_y, TILE_HEIGHT, TILE_WIDTH,
+                          table_shm.name, output_shm.name, rgb.shape))
         
-        results = pool.map(kuwahara_filter_chunk, tasks)
+        executor = _worker_pool(num_workers)
+        try:
+            futures = [executor.submit(kuwahara_filter_chunk, task) for task in tasks]
+            # Every task must be done with the shared blocks before they are
+            # unlinked, so wait for all of them before raising the first error
+            wait(futures)
+            for future in futures:
+                future.result()
+        except BrokenProcessPool:
+            # A dead worker breaks the pool for good; drop it so the next
+            # call starts a fresh one
+            shutdown_worker_pool()
+            raise
         
-        for start_y, end_y, chunk_result in results:
-            output[start_y:end_y] = chunk_result
+        result = np.concatenate([rgb_out, alpha.astype(np.float32)], axis=2)
+        del table, rgb_out
+    finally:
+        for shm in (table_shm, output_shm):
+            shm.close()
+            shm.unlink()
     
-    return output
\ No newline at end of file
+    return result
\ No newline at end of file
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import sys
 import time
-from blur import apply_gaussian_blur
+from blur import apply_gaussian_blur, saturate_cast_u8
 from kuwahara import apply_kuwahara_filter
 from monte_carlo import monte_carlo_operation
 import numpy as np
@@ -37,7 +37,7 @@ def main():
     # Load image
     start_time = time.time()
     img = Image.open(input_path).convert('RGBA')
-    img_array = np.array(img, dtype=np.float32)
+    img_array = np.array(img)
     load_time = time.time() - start_time
     print(f"Image loading took {load_time * 1000:.2f}ms")
 
@@ -52,7 +52,8 @@ def main():
 
     # Save image
     start_time = time.time()
-    filtered_array = np.clip(filtered_array, 0, 255).astype(np.uint8)
+    if filtered_array.dtype != np.uint8:
+        filtered_array = saturate_cast_u8(filtered_array)
     filtered_img = Image.fromarray(filtered_array)
     filtered_img.save(output_path)
     save_time = time.time() - start_time
@@ -1,46 +1,103 @@
-from multiprocessing import Pool
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from numba import njit, prange, set_num_threads, config
 
 # Linear Congruential Generator - same formula across all languages
-class LCG:
-    def __init__(self, seed):
-        self.seed = seed
-    
-    def random(self):
-        self.seed = (self.seed * 1664525 + 1013904223) & 0xFFFFFFFF
-        return (self.seed & 0x7FFFFFFF) / 0x7FFFFFFF
-
-def monte_carlo_worker(args):
-    samples, seed = args
-    rng = LCG(seed)
+@njit(inline='always')
+def lcg_random(seed):
+    seed = (seed * 1664525 + 1013904223) & 0xFFFFFFFF
+    return seed, (seed & 0x7FFFFFFF) / 0x7FFFFFFF
+
+@njit(nogil=True, cache=True)
+def monte_carlo_worker(samples, seed):
     inside = 0
-    
+
     for _ in range(samples):
-        x = rng.random()
-        y = rng.random()
+        seed, x = lcg_random(seed)
+        seed, y = lcg_random(seed)
         if x*x + y*y <= 1.0:
             inside += 1
-    
+
+    return inside
+
+@njit(parallel=True, cache=True)
+def _monte_carlo_numba(samples, seeds):
+    inside = np.zeros(len(seeds), dtype=np.int64)
+    for i in prange(len(seeds)):
+        inside[i] = monte_carlo_worker(samples[i], seeds[i])
+    return inside
+
+# Lanes per NumPy batch: each uint32 state vector is 256 KB, small enough to stay in L2
+BATCH_SIZE = 1 << 16
+
+def lcg_jump(steps):
+    # Multiplier and increment that advance the LCG by `steps` (array) at once.
+    # uint32 arithmetic wraps mod 2**32, matching the LCG's modulus
+    mult = np.ones_like(steps, dtype=np.uint32)
+    inc = np.zeros_like(steps, dtype=np.uint32)
+    a = np.array([1664525], dtype=np.uint32)
+    c = np.array([1013904223], dtype=np.uint32)
+    steps = steps.copy()
+    while steps.any():
+        odd = (steps & 1).astype(bool)
+        mult[odd] *= a
+        inc[odd] = inc[odd] * a + c
+        a, c = a * a, c * a + c
+        steps >>= 1
+    return mult, inc
+
+# Vectorized alternative: BATCH_SIZE lanes each walk the same LCG sequence,
+# lane l handling samples l, l + BATCH_SIZE, ... The samples are the same
+# as in monte_carlo_worker, only visited in a different order, so the count
+# is identical
+def monte_carlo_numpy_worker(args):
+    samples, seed = args
+    lanes = min(BATCH_SIZE, samples)
+
+    # Lane l starts at the LCG state that gives x of sample l
+    mult, inc = lcg_jump(2 * np.arange(lanes, dtype=np.int64) + 1)
+    state = mult * np.uint32(seed) + inc
+    step_mult, step_inc = lcg_jump(np.array([2 * lanes], dtype=np.int64))
+
+    inside = 0
+    done = 0
+
+    while done < samples:
+        n = min(lanes, samples - done)
+        x_state = state[:n]
+        y_state = x_state * np.uint32(1664525) + np.uint32(1013904223)
+        x = (x_state & np.uint32(0x7FFFFFFF)) / 0x7FFFFFFF
+        y = (y_state & np.uint32(0x7FFFFFFF)) / 0x7FFFFFFF
+        inside += int(np.count_nonzero(x * x + y * y <= 1.0))
+        state = state * step_mult + step_inc
+        done += n
+
     return inside
 
-def monte_carlo_operation(total_samples, num_workers):
+def monte_carlo_operation(total_samples, num_workers, method='lcg'):
     samples_per_worker = total_samples // num_workers
     remainder = total_samples % num_workers
-    
-    tasks = []
-    for i in range(num_workers):
-        samples = samples_per_worker
-        if i == num_workers - 1:
-            samples += remainder
-        tasks.append((samples, 12345 + i * 67890))  # Consistent seed pattern
-    
-    with Pool(processes=num_workers) as pool:
-        results = pool.map(monte_carlo_worker, tasks)
-    
-    total_inside = sum(results)
+
+    samples = np.full(num_workers, samples_per_worker, dtype=np.int64)
+    samples[-1] += remainder
+    seeds = 12345 + np.arange(num_workers, dtype=np.int64) * 67890  # Consistent seed pattern
+
+    if method == 'lcg':
+        set_num_threads(max(1, min(num_workers, config.NUMBA_NUM_THREADS)))
+        results = _monte_carlo_numba(samples, seeds)
+    elif method == 'numpy':
+        # NumPy releases the GIL inside each batch operation
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(monte_carlo_numpy_worker,
+                                        zip(samples.tolist(), seeds.tolist())))
+    else:
+        raise ValueError(f"Unknown Monte Carlo method: {method}")
+
+    total_inside = int(sum(results))
     pi_estimate = 4.0 * total_inside / total_samples
-    
+
     print(f"Monte Carlo Pi Estimation")
     print(f"Total samples: {total_samples}")
     print(f"Points inside circle: {total_inside}")
     print(f"Pi estimate: {pi_estimate:.6f}")
-    print(f"Error: {3.141592653589793 - pi_estimate:.6f}")
\ No newline at end of file
+    print(f"Error: {3.141592653589793 - pi_estimate:.6f}")